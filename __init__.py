@@ -1,4 +1,4 @@
 # Tokencount package
-from tokencount import cli, main, count_tokens_in_text
+from tokencount import cli, main, process_chunk
 
 __version__ = "0.1.0"
\ No newline at end of file
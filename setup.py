@@ -22,6 +22,9 @@ setup(
     ],
     python_requires=">=3.8",
     install_requires=requirements,
+    extras_require={
+        "hf": ["tokenizers"],
+    },
     py_modules=["tokencount"],
     entry_points={
         "console_scripts": [
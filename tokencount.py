@@ -1,17 +1,331 @@
 #!/usr/bin/env python3
 import tiktoken
-from datasets import load_dataset
+import duckdb
 from tqdm import tqdm
 import click
+import heapq
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Optional, Tuple
 
+try:
+    import pyarrow  # noqa: F401  (needed by DuckDB's record-batch reader)
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
 
-def count_tokens_in_text(text, encoding):
-    """Count the number of tokens in a text string."""
-    if not text or not isinstance(text, str):
-        return 0
-    return len(encoding.encode(text))
+# Maps file suffix to the DuckDB table function reading that format.
+# Each template takes a list of file paths so DuckDB's multi-file
+# reader can parallelize across the whole group with one plan node.
+SOURCE_TEMPLATES = {
+    '.parquet': "read_parquet([{}])",
+    '.csv': "read_csv_auto([{}], union_by_name=true)",
+    '.json': "read_json_auto([{}], union_by_name=true)",
+    '.jsonl': "read_json_auto([{}], union_by_name=true)",
+}
+SUPPORTED_EXTENSIONS = tuple(SOURCE_TEMPLATES)
+
+# Concurrent file scans per worker process. DuckDB releases the GIL
+# during query execution and tiktoken during encode_ordinary_batch, so
+# threads overlap I/O and tokenization without extra IPC.
+FILE_THREADS = 4
+
+# Below this input size, pool startup and result pickling outweigh the
+# compute, so the dataset is processed in-process instead.
+SMALL_DATASET_BYTES = 50 << 20
+
+
+def _data_suffix(path: Path) -> str:
+    """Return the format suffix of a data file, looking through .gz."""
+    suffix = path.suffix.lower()
+    if suffix == '.gz':
+        suffix = Path(path.stem).suffix.lower()
+    return suffix
+
+
+@lru_cache(maxsize=4)
+def _get_encoding(encoding_name: str):
+    """Load a tiktoken encoding, caching it per process.
+
+    Building an encoding parses the merges file and constructs the BPE
+    tables, which takes hundreds of milliseconds for large vocabularies
+    like o200k_base, so it should only ever happen once per process.
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
+class _TiktokenBackend:
+    """Adapter giving tiktoken's Encoding the common encode_batch interface."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def encode_batch(self, texts: list, num_threads: int) -> list:
+        return self.encoding.encode_ordinary_batch(texts, num_threads=num_threads)
+
+
+class _HFTokenizersBackend:
+    """Adapter for the Hugging Face tokenizers library's batch path.
+
+    tokenizers sizes its internal Rayon pool itself (RAYON_NUM_THREADS),
+    so the num_threads hint is not forwarded.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def encode_batch(self, texts: list, num_threads: int) -> list:
+        encoded = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [item.ids for item in encoded]
+
+
+# Hugging Face Hub repos carrying the same vocabularies as the tiktoken
+# encodings, for the optional hf_tokenizers backend.
+_HF_TOKENIZER_REPOS = {
+    'o200k_base': 'Xenova/gpt-4o',
+    'cl100k_base': 'Xenova/gpt-4',
+}
+
+
+def get_tokenizer(encoding_name: str, backend: str = 'tiktoken'):
+    """Build the tokenizer backend used by the workers.
+
+    Returns an object with encode_batch(texts, num_threads) so the rest
+    of the pipeline does not care which implementation does the BPE.
+    """
+    if backend == 'tiktoken':
+        return _TiktokenBackend(_get_encoding(encoding_name))
+    if backend == 'hf_tokenizers':
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise click.ClickException(
+                "The hf_tokenizers backend requires the 'tokenizers' package "
+                "(pip install 'tokencount[hf]').")
+        repo = _HF_TOKENIZER_REPOS.get(encoding_name)
+        if repo is None:
+            raise click.ClickException(
+                f"No Hugging Face tokenizer known for encoding {encoding_name}; "
+                "use the tiktoken backend.")
+        return _HFTokenizersBackend(Tokenizer.from_pretrained(repo))
+    raise click.ClickException(f"Unknown tokenizer backend: {backend}")
+
+
+# Set by _init_worker when running inside a worker process.
+_WORKER_TOKENIZER = None
+_WORKER_CON = None
+
+
+def _init_worker(encoding_name: str, backend: str = 'tiktoken'):
+    """Eagerly set up worker state when a pool worker starts.
+
+    Run as the ProcessPoolExecutor initializer so the BPE tables and
+    the DuckDB database are built once during worker bring-up,
+    overlapping with pool startup, instead of on the first chunk each
+    worker executes.
+    """
+    global _WORKER_TOKENIZER, _WORKER_CON
+    _WORKER_TOKENIZER = get_tokenizer(encoding_name, backend)
+    _WORKER_CON = duckdb.connect()
+
+
+def _worker_connection():
+    """Return the worker's shared DuckDB connection, creating it lazily.
+
+    The lazy path covers direct calls outside a pool (no initializer).
+    """
+    global _WORKER_CON
+    if _WORKER_CON is None:
+        _WORKER_CON = duckdb.connect()
+    return _WORKER_CON
+
+
+def process_chunk(texts: list, tokenizer, num_threads: Optional[int] = None) -> Tuple[int, int]:
+    """Tokenize a batch of texts and return (token_count, processed_count).
+
+    Uses the backend's batch API so the BPE work for the whole batch runs
+    on an internal thread pool instead of paying one FFI call per row.
+    Callers are expected to have filtered out NULLs already; a non-string
+    column surfaces as a per-file error upstream.
+    """
+    if not texts:
+        return 0, 0
+    if num_threads is None:
+        num_threads = max(1, os.cpu_count() or 1)
+    token_ids = tokenizer.encode_batch(texts, num_threads)
+    # sum(map(len, ...)) runs the reduction in C, without the generator
+    # protocol overhead of a genexpr.
+    return sum(map(len, token_ids)), len(texts)
+
+
+def _quote_identifier(name: str) -> str:
+    """Quote a column name for safe interpolation into SQL.
+
+    DuckDB cannot bind identifiers as prepared-statement parameters, so
+    the field name is escaped and double-quoted instead.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def files_source(file_paths: list) -> str:
+    """Return the DuckDB table function expression for a group of
+    same-format data files.
+
+    Returns None for unsupported file formats.
+    """
+    template = SOURCE_TEMPLATES.get(_data_suffix(Path(file_paths[0])))
+    if template is None:
+        return None
+    quoted = ", ".join("'" + str(path).replace("'", "''") + "'" for path in file_paths)
+    return template.format(quoted)
+
+
+def group_files_by_format(files: list) -> list:
+    """Group file paths by format suffix, preserving order within groups."""
+    groups = {}
+    for file_path in files:
+        groups.setdefault(_data_suffix(Path(file_path)), []).append(file_path)
+    return list(groups.values())
+
+
+def discover_files(dataset_path: str) -> list:
+    """List the supported data files in a directory, in a stable order."""
+    files = []
+    for path in sorted(Path(dataset_path).iterdir()):
+        if path.is_file() and _data_suffix(path) in SUPPORTED_EXTENSIONS:
+            files.append(str(path))
+    return files
+
+
+def _scan_files(con, file_paths: list, field_ident: str, tokenizer,
+                batch_size: int, num_threads: int) -> tuple:
+    """Scan a group of same-format files on one cursor and tokenize them.
+
+    The whole group goes through a single multi-file table function call
+    so DuckDB's internal scheduler parallelizes across the files with one
+    plan node. Streams the scan as Arrow record batches so memory stays
+    bounded by batch_size instead of the group's row count, and extracts
+    the column per batch to skip the per-row 1-tuple wrappers fetchall()
+    allocates. Runs on a worker-local thread pool; the cursor gives each
+    thread its own query state on the shared connection.
+    """
+    source = files_source(file_paths)
+    cursor = con.cursor()
+    total_tokens = 0
+    total_processed = 0
+    # NULL and empty rows are filtered inside DuckDB, vectorized on the
+    # scan, so they never cross the C-Python boundary at all.
+    predicate = f"{field_ident} IS NOT NULL AND length({field_ident}) > 0"
+    try:
+        if _HAS_PYARROW:
+            reader = cursor.execute(
+                f"SELECT {field_ident} FROM {source} WHERE {predicate}"
+            ).fetch_record_batch(batch_size)
+            for batch in reader:
+                texts = batch.column(0).to_pylist()
+                tokens_count, processed_count = process_chunk(texts, tokenizer, num_threads)
+                total_tokens += tokens_count
+                total_processed += processed_count
+            return total_tokens, total_processed
+        # Degraded path without pyarrow: aggregate each page into a
+        # single list() cell so the DuckDB-Python bridge still avoids
+        # allocating a 1-tuple per row. Pages with LIMIT/OFFSET, which
+        # re-scans skipped rows — acceptable for the fallback only. The
+        # SQL string is reused so DuckDB can cache the prepared plan.
+        sql = (f"SELECT list({field_ident}) FROM "
+               f"(SELECT {field_ident} FROM {source} WHERE {predicate} LIMIT ? OFFSET ?)")
+        offset = 0
+        while True:
+            page = cursor.execute(sql, [batch_size, offset]).fetchone()[0]
+            if not page:
+                break
+            tokens_count, processed_count = process_chunk(page, tokenizer, num_threads)
+            total_tokens += tokens_count
+            total_processed += processed_count
+            if len(page) < batch_size:
+                break
+            offset += batch_size
+        return total_tokens, total_processed
+    finally:
+        cursor.close()
+
+
+def partition_files_by_size(files: list, chunks: int) -> list:
+    """Partition files into at most `chunks` byte-balanced shards.
+
+    BPE cost is roughly linear in input bytes, so balancing shards by
+    file size rather than file count keeps skewed datasets from leaving
+    one worker with a far larger tokenization bill. Uses the LPT
+    (Longest Processing Time first) heuristic: place each file, largest
+    first, onto the currently smallest shard.
+    """
+    if not files:
+        return []
+    if chunks <= 1:
+        return [list(files)]
+    sized = sorted(((Path(path).stat().st_size, path) for path in files), reverse=True)
+    shards = [[] for _ in range(min(chunks, len(files)))]
+    heap = [(0, index) for index in range(len(shards))]
+    for size, path in sized:
+        shard_bytes, index = heapq.heappop(heap)
+        shards[index].append(path)
+        heapq.heappush(heap, (shard_bytes + size, index))
+    return shards
+
+
+def process_directory_chunk(files: list, field: str, encoding_name: str,
+                            batch_size: int, num_threads: int,
+                            backend: str = 'tiktoken') -> tuple:
+    """Tokenize one chunk's share of the dataset files.
+
+    The parent discovers files once and passes each chunk its own file
+    list, so workers do no directory globbing of their own, and each
+    file is scanned exactly once with DuckDB — no repeated re-planning
+    or re-reading of the whole dataset per batch window.
+
+    Returns (status, token_count, processed_count); status is an empty
+    string on success or a description of any per-file errors.
+
+    IPC contract: the return value must stay a small (str, int, int)
+    tuple — a few tens of bytes — since ProcessPoolExecutor pickles it
+    through a pipe and large results hit a serialization cliff.
+    Extensions that need bulk results (per-file stats, token-length
+    histograms) should write them into a multiprocessing.shared_memory
+    block allocated by the parent and return only its name here.
+    """
+    if _WORKER_TOKENIZER is not None:
+        tokenizer = _WORKER_TOKENIZER
+    else:
+        tokenizer = get_tokenizer(encoding_name, backend)
+    field_ident = _quote_identifier(field)
+    total_tokens = 0
+    total_processed = 0
+    errors = []
+    # Derive a lightweight cursor from the worker's long-lived
+    # connection rather than opening a fresh database per chunk; the
+    # scan threads derive their own cursors from it in turn.
+    con = _worker_connection().cursor()
+    try:
+        file_groups = group_files_by_format(files)
+        with ThreadPoolExecutor(max_workers=min(FILE_THREADS, max(1, len(file_groups)))) as pool:
+            futures = {
+                pool.submit(_scan_files, con, group, field_ident, tokenizer,
+                            batch_size, num_threads): group
+                for group in file_groups
+            }
+            for future in as_completed(futures):
+                try:
+                    tokens_count, processed_count = future.result()
+                    total_tokens += tokens_count
+                    total_processed += processed_count
+                except Exception as e:
+                    errors.append(f"Error reading {', '.join(futures[future])}: {e}")
+    finally:
+        con.close()
+    return "; ".join(errors), total_tokens, total_processed
 
 
 @click.command()
@@ -19,14 +333,21 @@ def count_tokens_in_text(text, encoding):
 @click.argument('field', type=str)
 @click.option('--model', default='gpt-4o', help='Model name to use for tokenization')
 @click.option('--batch-size', default=1000, help='Batch size for processing rows')
-def main(dataset_path, field, model, batch_size):
+@click.option('--workers', default=max(1, (os.cpu_count() or 1) // FILE_THREADS),
+              help='Number of worker processes')
+@click.option('--chunks', default=None, type=int,
+              help='Number of work chunks (default: one per worker; raise for better load balance)')
+@click.option('--tokenizer', 'backend', default='tiktoken',
+              type=click.Choice(['tiktoken', 'hf_tokenizers']),
+              help='Tokenizer backend (hf_tokenizers needs the optional tokenizers package)')
+def main(dataset_path, field, model, batch_size, workers, chunks, backend):
     """Count tokens in files using tiktoken.
-    
+
     DATASET_PATH is the path to the folder containing data files.
     FIELD is the column/field name containing the text to tokenize.
-    
-    The tool uses HuggingFace datasets to load data files and is
-    format-agnostic (supports jsonl, json, parquet, csv, etc.)
+
+    The tool uses DuckDB to read data files and is format-agnostic
+    (supports jsonl, json, parquet and csv, plain or gzipped).
     """
     try:
         encoding = tiktoken.encoding_for_model(model)
@@ -34,45 +355,82 @@ def main(dataset_path, field, model, batch_size):
     except KeyError:
         click.echo(f"Model {model} not found. Using 'o200k_base' encoding instead.")
         encoding_name = "o200k_base"
-        encoding = tiktoken.get_encoding(encoding_name)
-    
+
     click.echo(f"Using encoding: {encoding_name}")
-    
+
+    # Build the backend once in the parent so a missing optional
+    # dependency or unmapped encoding fails here with a clear message
+    # instead of killing every pool worker inside _init_worker.
+    try:
+        get_tokenizer(encoding_name, backend)
+    except click.ClickException:
+        raise
+    except Exception as e:
+        raise click.ClickException(f"Could not initialize the {backend} backend: {e}")
+
     dataset_path = Path(dataset_path).resolve()
     click.echo(f"Processing dataset: {dataset_path}")
     click.echo(f"Field to tokenize: {field}")
-    
-    click.echo("Loading dataset...")
-    
+
+    workers = max(1, workers or 1)
+    chunks = max(workers, chunks or workers)
+    # Over-decomposing (chunks > workers) trades a little scheduling
+    # overhead for straggler mitigation on skewed file sizes; batch the
+    # task submissions accordingly instead of pickling them one by one.
+    map_chunksize = max(1, chunks // (workers + 2))
+    # Split the tokenizer's internal thread pool across workers so the
+    # total thread count roughly matches the machine's cores.
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    total_tokens = 0
+    total_processed = 0
+
     try:
-        # Load the dataset directly from the path
-        dataset = load_dataset(
-            str(dataset_path),
-            streaming=True
-        )
-        
-        # Handle different dataset structures
-        if isinstance(dataset, dict) and 'train' in dataset:
-            dataset = dataset['train']
-        
-        click.echo("Dataset loaded successfully")
-        
-        # Initialize counters
-        total_tokens = 0
-        total_processed = 0
-        
-        # Process the dataset (streaming compatible)
-        progress_bar = tqdm(dataset, desc="Tokenizing", unit="tokens")
-        for item in dataset:
-            if field in item and item[field]:
-                text = item[field]
-                tokens_count = count_tokens_in_text(text, encoding)
-                total_tokens += tokens_count
-                total_processed += 1
-                
-                # Update progress bar with token count
-                progress_bar.update(tokens_count)
-        
+        # Discover files once here; workers receive their own file lists
+        # and never stat the directory themselves.
+        files = discover_files(str(dataset_path))
+        if not files:
+            click.echo("No supported data files found.", err=True)
+        file_shards = partition_files_by_size(files, chunks)
+        total_bytes = sum(Path(path).stat().st_size for path in files)
+        run_inline = (workers == 1 or len(file_shards) <= 1
+                      or total_bytes < SMALL_DATASET_BYTES)
+
+        def run_chunks():
+            if run_inline:
+                # One process with DuckDB's scan threads plus tiktoken's
+                # batch threads already fills the cores at this scale.
+                if files:
+                    yield process_directory_chunk(files, field, encoding_name,
+                                                  batch_size, max(1, os.cpu_count() or 1),
+                                                  backend)
+                return
+            process_func = partial(
+                process_directory_chunk,
+                field=field,
+                encoding_name=encoding_name,
+                batch_size=batch_size,
+                num_threads=num_threads,
+                backend=backend,
+            )
+            # forkserver brings workers up faster than spawn without fork's
+            # risk of inheriting threads; fall back where it is unavailable.
+            start_methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in start_methods else None)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                     initializer=_init_worker,
+                                     initargs=(encoding_name, backend)) as executor:
+                yield from executor.map(process_func, file_shards, chunksize=map_chunksize)
+
+        total_chunks = 1 if run_inline and files else len(file_shards)
+        for status, tokens_count, processed_count in tqdm(run_chunks(), total=total_chunks,
+                                                          desc="Tokenizing", unit="chunk"):
+            if status:
+                click.echo(status, err=True)
+            total_tokens += tokens_count
+            total_processed += processed_count
+
         # Print summary
         click.echo(f"\nTotal tokens: {total_tokens}")
         click.echo(f"Total items processed: {total_processed}")
@@ -80,7 +438,7 @@ def main(dataset_path, field, model, batch_size):
             click.echo(f"Average tokens per item: {total_tokens / total_processed:.2f}")
         else:
             click.echo("Average tokens per item: 0.00")
-            
+
     except Exception as e:
         click.echo(f"Error processing dataset: {e}", err=True)
 
@@ -91,4 +449,4 @@ def cli():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()